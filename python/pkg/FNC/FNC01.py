@@ -1,12 +1,33 @@
-def horner(c,x):
+import numpy as np
+from math import factorial
+
+def horner(c, x, nder=0):
     """
-    horner(c,x)
+    horner(c, x, nder=0)
 
-    Evaluate a polynomial whose coefficients are given in descending order 
-    in c, at the point x, using Horner's rule.
+    Evaluate a polynomial whose coefficients are given in descending order
+    in c, at the point x, using Horner's rule. If c is a 2-D array, each row
+    is a separate polynomial and the result has one row per polynomial and
+    shape (rows, *shape(x)). If nder > 0, the first nder derivatives are
+    computed in the same pass and the result is stacked along a new leading
+    axis of length nder+1 (values first).
     """
-    n = len(c)
-    y = c[0]
+    c = np.asarray(c)
+    x = np.asarray(x)
+    C = np.atleast_2d(c)
+    m, n = C.shape
+    C = C.reshape((m, n) + (1,) * x.ndim)    # broadcast each row against x
+
+    # y[j] accumulates the jth Taylor coefficient, i.e., p^(j)(x) / j!.
+    y = np.zeros((nder + 1, m) + x.shape, dtype=np.result_type(C, x, float))
+    y[0] = C[:, 0]
     for k in range(1, n):
-        y = x * y + c[k]   
-    return y
\ No newline at end of file
+        for j in range(min(nder, k), 0, -1):
+            y[j] = x * y[j] + y[j - 1]
+        y[0] = x * y[0] + C[:, k]
+
+    for j in range(2, nder + 1):
+        y[j] *= factorial(j)
+    if c.ndim < 2:
+        y = y[:, 0]
+    return y[0] if nder == 0 else y
@@ -1,52 +1,84 @@
 import numpy as np
+from scipy.linalg import solve_triangular, cholesky
 
-def forwardsub(L,b):
+def forwardsub(L,b,order=None):
     """
-     forwardsub(L,b)
+     forwardsub(L,b,order=None)
 
     Solve the lower-triangular linear system with matrix L and right-hand side
-    vector b.
+    vector b. If b is an n-by-k matrix, all k systems are solved together. By
+    default (or with order="C"), each row of x comes from a row inner product
+    with L, done as a matrix product, which is the fastest sweep for either
+    memory layout of L. With order="F", each solved row is instead subtracted
+    from the remaining rows by a column update (axpy).
+
+    L may also be a stack of matrices with shape (..., n, n), with b of shape
+    (..., n) or (..., n, k). Then every system in the stack is solved at once.
     """
-    n = len(b)
-    x = np.zeros(n)
-    for i in range(n):
-        s = L[i,:i] @ x[:i]
-        x[i] = ( b[i] - s ) / L[i, i]
-    return x
+    L, B, isvec = _stacked(L, b)
+    n = B.shape[-2]
+    x = np.zeros(np.broadcast_shapes(L.shape[:-2], B.shape[:-2]) + B.shape[-2:])
+    if order == "F":
+        r = x + B
+        for j in range(n):
+            x[..., j:j+1, :] = r[..., j:j+1, :] / L[..., j:j+1, j:j+1]
+            r[..., j+1:, :] -= L[..., j+1:, j:j+1] * x[..., j:j+1, :]
+    else:
+        for i in range(n):
+            s = L[..., i:i+1, :i] @ x[..., :i, :]
+            x[..., i:i+1, :] = ( B[..., i:i+1, :] - s ) / L[..., i:i+1, i:i+1]
+    return x[..., 0] if isvec else x
 
 
-def backsub(U,b):
+def backsub(U,b,order=None):
     """
-    backsub(U,b)
+    backsub(U,b,order=None)
 
     Solve the upper-triangular linear system with matrix U and right-hand side
-    vector b.
+    vector b. If b is an n-by-k matrix, all k systems are solved together. The
+    order argument, and stacked U and b, are as in forwardsub.
     """
-    n = len(b)
-    x = np.zeros(n)
-    for i in range(n-1, -1, -1):
-        s = U[i, i+1:] @ x[i+1:]
-        x[i] = ( b[i] - s ) / U[i, i]
-    return x
+    U, B, isvec = _stacked(U, b)
+    n = B.shape[-2]
+    x = np.zeros(np.broadcast_shapes(U.shape[:-2], B.shape[:-2]) + B.shape[-2:])
+    if order == "F":
+        r = x + B
+        for j in range(n-1, -1, -1):
+            x[..., j:j+1, :] = r[..., j:j+1, :] / U[..., j:j+1, j:j+1]
+            r[..., :j, :] -= U[..., :j, j:j+1] * x[..., j:j+1, :]
+    else:
+        for i in range(n-1, -1, -1):
+            s = U[..., i:i+1, i+1:] @ x[..., i+1:, :]
+            x[..., i:i+1, :] = ( B[..., i:i+1, :] - s ) / U[..., i:i+1, i:i+1]
+    return x[..., 0] if isvec else x
+
+def _stacked(A, b):
+    # Put the right-hand side of a (possibly stacked) triangular system in
+    # matrix form, noting whether it started as a vector.
+    A, b = np.asarray(A), np.asarray(b)
+    isvec = b.ndim == A.ndim - 1
+    return A, (b[..., None] if isvec else b), isvec
 
 def lufact(A):
     """
     lufact(A)
 
     Compute the LU factorization of square matrix A, returning the
-    factors.
+    factors. A may also be a stack of matrices with shape (..., n, n), in
+    which case all of them are factored together.
     """
-    n = A.shape[0]     # detect the dimensions from the input
-    L = np.eye(n)      # ones on main diagonal, np.zeros elsewhere
-    U = np.zeros((n, n))
-    A_k = np.copy(A)   # make a working np.copy 
+    n = A.shape[-1]    # detect the dimensions from the input
+    L = np.zeros(A.shape)
+    L[..., range(n), range(n)] = 1    # ones on main diagonal, zeros elsewhere
+    U = np.zeros(A.shape)
+    A_k = np.array(A, dtype=float)    # make a working copy
 
-    # Reduction by np.outer products
+    # Reduction by outer products
     for k in range(n-1):
-        U[k, :] = A_k[k, :]
-        L[:, k] = A_k[:, k] / U[k,k]
-        A_k -= np.outer(L[:,k], U[k,:])
-    U[n-1, n-1] = A_k[n-1, n-1]
+        U[..., k, k:] = A_k[..., k, k:]
+        L[..., k:, k] = A_k[..., k:, k] / U[..., k, k, None]
+        A_k[..., k+1:, k+1:] -= L[..., k+1:, k, None] * U[..., None, k, k+1:]
+    U[..., n-1, n-1] = A_k[..., n-1, n-1]
     return L, U
 
 def plufact(A):
@@ -54,19 +86,347 @@ def plufact(A):
         plufact(A)
 
     Compute the PLU factorization of square matrix A, returning the
-    triangular factors and a row permutation vector.
+    triangular factors and a row permutation vector. A may also be a stack
+    of matrices with shape (..., n, n), in which case all of them are
+    factored together, each with its own pivoting, and p has shape (..., n).
     """
-    n = A.shape[0]
-    L = np.zeros((n, n))
-    U = np.zeros((n, n))
-    p = np.zeros(n, dtype=int)
-    A_k = np.copy(A)
+    n = A.shape[-1]
+    L = np.zeros(A.shape)
+    U = np.zeros(A.shape)
+    p = np.zeros(A.shape[:-1], dtype=int)
+    A_k = np.array(A, dtype=float)
 
-    # Reduction by np.outer products
+    # Reduction by outer products. Columns to the left of k are finished,
+    # so only the columns to the right need updating.
     for k in range(n):
-        p[k] = np.argmax(abs(A_k[:, k]))
-        U[k, :] = A_k[p[k], :]
-        L[:, k] = A_k[:, k] / U[k, k]
+        p[..., k] = np.argmax(abs(A_k[..., :, k]), axis=-1)
+        pivotrow = np.take_along_axis(A_k, p[..., k, None, None], axis=-2)
+        U[..., k, k:] = pivotrow[..., 0, k:]
+        L[..., :, k] = A_k[..., :, k] / U[..., k, k, None]
         if k < n-1:
-            A_k -= np.outer(L[:, k], U[k, :])
-    return L[p, :], U, p
\ No newline at end of file
+            A_k[..., :, k+1:] -= L[..., :, k, None] * U[..., None, k, k+1:]
+    return np.take_along_axis(L, p[..., None], axis=-2), U, p
+
+def plufactblock(A, blocksize=64, overwrite_a=False):
+    """
+    plufactblock(A, blocksize=64, overwrite_a=False)
+
+    Compute the PLU factorization of square matrix A by blocked, right-looking
+    elimination with row pivoting. Returns a single matrix holding the packed
+    factors (unit lower triangle of L below the diagonal, U on and above it)
+    and a row permutation vector p such that A[p, :] = L @ U. The factors
+    keep the floating-point precision of A. If overwrite_a is True and A is a
+    floating-point array, A itself is overwritten with the factors.
+    """
+    if overwrite_a and isinstance(A, np.ndarray) and A.dtype.kind in "fc":
+        LU = A
+    else:
+        dtype = np.asarray(A).dtype
+        LU = np.array(A, dtype=dtype if dtype.kind in "fc" else float)
+    n = LU.shape[0]
+    p = np.arange(n)
+
+    for j in range(0, n, blocksize):
+        jb = min(j + blocksize, n)
+        # Factor the current panel of columns one column at a time.
+        for k in range(j, jb):
+            i = k + np.argmax(abs(LU[k:, k]))
+            if i != k:
+                LU[[k, i], :] = LU[[i, k], :]
+                p[[k, i]] = p[[i, k]]
+            LU[k+1:, k] /= LU[k, k]
+            LU[k+1:, k+1:jb] -= np.outer(LU[k+1:, k], LU[k, k+1:jb])
+        if jb < n:
+            # Block row of U, then the trailing submatrix update.
+            LU[j:jb, jb:] = solve_triangular(LU[j:jb, j:jb], LU[j:jb, jb:],
+                lower=True, unit_diagonal=True)
+            LU[jb:, jb:] -= LU[jb:, j:jb] @ LU[j:jb, jb:]
+    return LU, p
+
+def unpacklu(LU):
+    """
+    unpacklu(LU)
+
+    Separate the packed factors returned by plufactblock into the unit lower
+    triangular L and the upper triangular U.
+    """
+    n = LU.shape[0]
+    return np.tril(LU, -1) + np.eye(n), np.triu(LU)
+
+def bandlu(ab, l, u):
+    """
+    bandlu(ab, l, u)
+
+    Compute the LU factorization with row pivoting of a square banded matrix
+    with l subdiagonals and u superdiagonals, given in compact diagonal storage
+    ab[u + i - j, j] = A[i, j]. Returns the banded unit lower factor Lb
+    (Lb[i - j, j] = L[i, j]), the banded upper factor Ub with l+u
+    superdiagonals, and a vector of row interchanges for bandforwardsub.
+    The work is O(n*l*(l+u)). Raises LinAlgError if the matrix is singular.
+    """
+    n = ab.shape[1]
+    c = l + u                      # row of W holding the main diagonal
+    # Working storage, with room for fill-in from pivoting and padding on the
+    # right so that every elimination window has the same shape.
+    W = np.zeros((2*l + u + 1, n + c), dtype=np.result_type(ab.dtype, float))
+    W[l:, :n] = ab
+    i = np.arange(W.shape[0])[:, None] - c + np.arange(n + c)
+    W[(i < 0) | (i >= n)] = 0      # storage corners that lie outside A
+
+    # Flat positions of the (l+1)-by-(l+u+1) window below and right of A[0, 0].
+    # The window for A[k, k] is found by shifting these by k.
+    r, q = np.meshgrid(np.arange(l + 1), np.arange(c + 1), indexing="ij")
+    window = (c + r - q) * W.shape[1] + q
+    Wflat = W.reshape(-1)
+    piv = np.arange(n)
+    for k in range(n):
+        B = Wflat[window + k]
+        i = np.argmax(abs(B[:, 0]))
+        if i > 0:
+            B[[0, i]] = B[[i, 0]]
+            piv[k] = k + i
+        if B[0, 0] == 0:
+            raise np.linalg.LinAlgError("Singular matrix")
+        B[1:, 0] /= B[0, 0]
+        B[1:, 1:] -= np.outer(B[1:, 0], B[0, 1:])
+        Wflat[window + k] = B
+
+    Lb = W[c:, :n].copy()
+    Lb[0] = 1
+    return Lb, W[:c+1, :n].copy(), piv
+
+def bandforwardsub(Lb, b, piv=None):
+    """
+    bandforwardsub(Lb, b, piv=None)
+
+    Solve the lower-triangular banded linear system with matrix L given in
+    compact storage Lb[i - j, j] = L[i, j] and right-hand side vector (or
+    matrix) b. If the row interchanges piv from bandlu are given, they are
+    applied as the sweep reaches each row.
+    """
+    l = Lb.shape[0] - 1
+    n = len(b)
+    x = np.array(b, dtype=float)
+    for j in range(n):
+        if piv is not None and piv[j] != j:
+            x[[j, piv[j]]] = x[[piv[j], j]]
+        x[j] /= Lb[0, j]
+        m = min(l, n - 1 - j)
+        x[j+1:j+1+m] -= np.multiply.outer(Lb[1:1+m, j], x[j])
+    return x
+
+def bandbacksub(Ub, b):
+    """
+    bandbacksub(Ub, b)
+
+    Solve the upper-triangular banded linear system with matrix U given in
+    compact storage Ub[u + i - j, j] = U[i, j] and right-hand side vector (or
+    matrix) b.
+    """
+    u = Ub.shape[0] - 1
+    n = len(b)
+    x = np.array(b, dtype=float)
+    for j in range(n-1, -1, -1):
+        x[j] /= Ub[u, j]
+        m = min(u, j)
+        x[j-m:j] -= np.multiply.outer(Ub[u-m:u, j], x[j])
+    return x
+
+def bandsolve(ab, l, u, b):
+    """
+    bandsolve(ab, l, u, b)
+
+    Solve the square banded linear system A x = b, where A has l subdiagonals
+    and u superdiagonals and is given in compact storage ab[u + i - j, j] =
+    A[i, j]. The work is O(n*l*(l+u)) instead of O(n^3).
+    """
+    Lb, Ub, piv = bandlu(ab, l, u)
+    return bandbacksub(Ub, bandforwardsub(Lb, b, piv))
+
+class LUFactorization:
+    """
+    LUFactorization(A)
+
+    Compute the PLU factorization of square matrix A once, keeping the packed
+    factors and the row permutation, so that any number of linear systems with
+    A or its transpose can be solved at O(n^2) cost each.
+    """
+    def __init__(self, A):
+        self.norm1 = np.max(np.sum(abs(np.asarray(A)), axis=0))
+        self.LU, self.p = plufactblock(A)
+
+    def solve(self, b):
+        """Solve A x = b, where b is a vector or a matrix of right-hand sides."""
+        z = solve_triangular(self.LU, np.asarray(b)[self.p], lower=True, unit_diagonal=True)
+        return solve_triangular(self.LU, z)
+
+    def solve_transpose(self, b):
+        """Solve A.T x = b, where b is a vector or a matrix of right-hand sides."""
+        z = solve_triangular(self.LU, b, trans="T")
+        z = solve_triangular(self.LU, z, trans="T", lower=True, unit_diagonal=True)
+        x = np.empty_like(z)
+        x[self.p] = z
+        return x
+
+    def logdet(self):
+        """Return the natural log of |det(A)|."""
+        return np.sum(np.log(abs(np.diag(self.LU))))
+
+    def condest(self):
+        """Estimate the 1-norm condition number of A."""
+        n = self.LU.shape[0]
+        return self.norm1 * _invnorm1est(self.solve, self.solve_transpose, n)
+
+class CholeskyFactorization:
+    """
+    CholeskyFactorization(A)
+
+    Compute the Cholesky factorization A = R.T @ R of a symmetric positive
+    definite matrix A once, so that any number of linear systems with A can
+    be solved at O(n^2) cost each.
+    """
+    def __init__(self, A):
+        self.R = cholesky(A)
+
+    def solve(self, b):
+        """Solve A x = b, where b is a vector or a matrix of right-hand sides."""
+        z = solve_triangular(self.R, b, trans="T")
+        return solve_triangular(self.R, z)
+
+    def solve_transpose(self, b):
+        """Solve A.T x = b. Since A is symmetric, this is the same as solve."""
+        return self.solve(b)
+
+    def logdet(self):
+        """Return the natural log of det(A)."""
+        return 2 * np.sum(np.log(np.diag(self.R)))
+
+def lusolvemixed(A, b, maxiter=10):
+    """
+    lusolvemixed(A, b, maxiter=10)
+
+    Solve the square linear system A x = b by an LU factorization computed in
+    single precision, followed by iterative refinement with residuals computed
+    in double precision. If the refinement has not reached double precision
+    accuracy after maxiter steps, the system is solved again with a double
+    precision factorization. Returns the solution, the number of refinement
+    steps taken, and True if the refinement succeeded (False if it fell back).
+    """
+    A = np.asarray(A, dtype=float)
+    b = np.asarray(b, dtype=float)
+    F = LUFactorization(A.astype(np.float32))
+    solve32 = lambda r: F.solve(r.astype(np.float32)).astype(float)
+
+    # Stop when the residual is at the level of double precision backward error.
+    n = A.shape[0]
+    tol = np.sqrt(n) * np.finfo(float).eps * np.max(np.sum(abs(A), axis=1))
+    x = solve32(b)
+    for k in range(maxiter + 1):
+        r = b - A @ x
+        if np.all(np.max(abs(r), axis=0) <= tol * np.max(abs(x), axis=0)):
+            return x, k, True
+        if k < maxiter:
+            x += solve32(r)
+
+    return LUFactorization(A).solve(b), maxiter, False
+
+def condest(A, L, U, p):
+    """
+    condest(A, L, U, p)
+
+    Estimate the 1-norm condition number of square matrix A, given the factors
+    L, U, and p returned by plufact. Uses the Hager-Higham estimator, which
+    needs only a few triangular solves instead of an SVD.
+    """
+    def solve(b):
+        return backsub(U, forwardsub(L, b[p]))
+
+    def solve_transpose(b):
+        # A[p, :] = L U, so A.T = U.T L.T P.
+        z = backsub(L.T, forwardsub(U.T, b))
+        x = np.empty_like(z)
+        x[p] = z
+        return x
+
+    n = A.shape[0]
+    return np.max(np.sum(abs(A), axis=0)) * _invnorm1est(solve, solve_transpose, n)
+
+def _invnorm1est(solve, solve_transpose, n, maxiter=5):
+    # Hager's method, with Higham's refinements, for a lower bound on
+    # ||inv(A)||_1 that is nearly always within a small factor of the truth.
+    x = np.full(n, 1 / n)
+    est = 0.0
+    for k in range(maxiter):
+        y = solve(x)
+        newest = np.sum(abs(y))
+        if k > 0 and newest <= est:
+            break
+        est = newest
+        z = solve_transpose(np.where(y >= 0, 1.0, -1.0))
+        j = np.argmax(abs(z))
+        if k > 0 and abs(z[j]) <= z @ x:
+            break
+        x = np.zeros(n)
+        x[j] = 1.0
+
+    # An alternating test vector guards against the worst failure cases.
+    v = (-1.0) ** np.arange(n) * (1 + np.arange(n) / max(n - 1, 1))
+    return max(est, 2 * np.sum(abs(solve(v))) / (3 * n))
+
+class WoodburyFactorization:
+    """
+    WoodburyFactorization(A, factor=None, maxrank=None)
+
+    Solve linear systems with a square matrix that changes by low-rank
+    corrections, reusing one LU factorization of A. After updates with
+    factors U and V, systems with A + U @ V.T are solved by the
+    Sherman-Morrison-Woodbury formula in O(n^2 k + k^3) time for total rank
+    k. An existing LUFactorization of A may be given as factor. Once the total
+    rank would exceed maxrank (default n//10), the matrix is refactored.
+    """
+    def __init__(self, A, factor=None, maxrank=None):
+        self.A = np.array(A, dtype=float)
+        n = self.A.shape[0]
+        self.factor = LUFactorization(self.A) if factor is None else factor
+        self.maxrank = max(1, n // 10) if maxrank is None else maxrank
+        self._reset()
+
+    def _reset(self):
+        n = self.A.shape[0]
+        self.U = np.zeros((n, 0))
+        self.V = np.zeros((n, 0))
+        self.Z = np.zeros((n, 0))    # inv(A) @ U
+        self._W = None               # inv(A).T @ V, computed when needed
+        self.C = None                # factored I + V.T @ inv(A) @ U
+
+    def update(self, U, V):
+        """Add U @ V.T to the current matrix. Returns the object, for chaining."""
+        U = np.reshape(U, (self.A.shape[0], -1))
+        V = np.reshape(V, (self.A.shape[0], -1))
+        if self.U.shape[1] + U.shape[1] > self.maxrank:
+            self.A += self.U @ self.V.T + U @ V.T
+            self.factor = LUFactorization(self.A)
+            self._reset()
+        else:
+            self.U = np.hstack([self.U, U])
+            self.V = np.hstack([self.V, V])
+            self.Z = np.hstack([self.Z, self.factor.solve(U)])
+            self._W = None
+            self.C = LUFactorization(np.eye(self.U.shape[1]) + self.V.T @ self.Z)
+        return self
+
+    def solve(self, b):
+        """Solve (A + U V^T) x = b."""
+        y = self.factor.solve(b)
+        if self.C is None:
+            return y
+        return y - self.Z @ self.C.solve(self.V.T @ y)
+
+    def solve_transpose(self, b):
+        """Solve (A + U V^T).T x = b."""
+        y = self.factor.solve_transpose(b)
+        if self.C is None:
+            return y
+        if self._W is None:
+            self._W = self.factor.solve_transpose(self.V)
+        return y - self._W @ self.C.solve_transpose(self.U.T @ y)
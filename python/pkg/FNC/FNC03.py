@@ -1,6 +1,13 @@
+import os
 import scipy
 import numpy as np
-from .FNC02 import forwardsub, backsub
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing.shared_memory import SharedMemory
+from scipy.linalg import solve_triangular, qr_multiply
+from scipy.fft import dct
+from scipy.sparse.linalg import aslinearoperator, LinearOperator
+from .FNC02 import CholeskyFactorization
 
 def lsnormal(A, b):
     """
@@ -11,11 +18,52 @@ def lsnormal(A, b):
     """
     N = A.T @ A
     z = A.T @ b
-    R = scipy.linalg.cholesky(N)
-    w = forwardsub(R.T, z)                   # solve R'z=c
-    x = backsub(R, w)                        # solve Rx=z
+    F = CholeskyFactorization(N)             # N = R'R
+    x = F.solve(z)                           # solve R'w=z, then Rx=w
     return x
 
+def lsnormalstream(A, b=None, blocksize=100000, executor=None):
+    """
+    lsnormalstream(A, b=None, blocksize=100000, executor=None)
+
+    Solve a linear least squares problem by the normal equations in one pass
+    over the rows, without holding all of A in memory. Either A and b are
+    arrays, such as an np.memmap or np.load(..., mmap_mode="r"), that are
+    read blocksize rows at a time, or b is omitted and A is an iterable of
+    (A_i, b_i) row blocks. If a concurrent.futures executor is given, blocks
+    are processed concurrently, with only a few in flight at a time. Returns
+    the minimizer of ||b-Ax||.
+    """
+    if b is None:
+        blocks = A
+    else:
+        blocks = ((A[i:i+blocksize], b[i:i+blocksize]) for i in range(0, A.shape[0], blocksize))
+
+    N, z = 0, 0
+    if executor is None:
+        for block in blocks:
+            Ni, zi = _normalblock(block)
+            N, z = N + Ni, z + zi
+    else:
+        pending = deque()
+        for block in blocks:
+            pending.append(executor.submit(_normalblock, block))
+            if len(pending) > 2 * (os.cpu_count() or 1):
+                Ni, zi = pending.popleft().result()
+                N, z = N + Ni, z + zi
+        for future in pending:
+            Ni, zi = future.result()
+            N, z = N + Ni, z + zi
+
+    F = CholeskyFactorization(N)             # N = R'R
+    x = F.solve(z)                           # solve R'w=z, then Rx=w
+    return x
+
+def _normalblock(block):
+    # Contribution of one row block to the normal equations.
+    Ai, bi = np.asarray(block[0], dtype=float), np.asarray(block[1], dtype=float)
+    return Ai.T @ Ai, Ai.T @ bi
+
 def lsqrfact(A, b):
     """
     lsqrfact(A, b)
@@ -23,29 +71,318 @@ def lsqrfact(A, b):
     Solve a linear least squares problem by QR factorization. Returns the
     minimizer of ||b-Ax||.
     """
-    Q, R = np.linalg.qr(A)
-    c = Q.T @ b
-    x = backsub(R, c)
+    # qr_multiply gives b'Q, i.e., (Q'b)', without forming Q.
+    c, R = qr_multiply(A, np.transpose(b), mode="right")
+    x = solve_triangular(R, np.transpose(c))
     return x
 
+def lsqrtsqr(A, b, processes=None, panels=None):
+    """
+    lsqrtsqr(A, b, processes=None, panels=None)
+
+    Solve a tall linear least squares problem by tall-skinny QR (TSQR). The
+    rows of [A b] are split into panels (by default, one per process) that are
+    QR-factored concurrently by a pool of processes reading from shared
+    memory. The triangular factors are then combined pairwise in a reduction
+    tree. Returns the minimizer of ||b-Ax||.
+    """
+    m, n = A.shape
+    processes = processes or os.cpu_count() or 1
+    panels = panels or processes
+    panels = max(1, min(panels, m // (n + 1)))    # each panel must be tall
+    bounds = np.linspace(0, m, panels + 1).astype(int)
+
+    if processes == 1:
+        Ab = np.column_stack([A, b])
+        R = [np.linalg.qr(Ab[i:j], mode="r") for i, j in zip(bounds[:-1], bounds[1:])]
+    else:
+        # Workers read their panels from one shared copy of [A b].
+        shm = SharedMemory(create=True, size=m * (n + 1) * 8)
+        Ab = np.ndarray((m, n + 1), dtype=float, buffer=shm.buf)
+        try:
+            Ab[:, :n], Ab[:, n] = A, b
+            with ProcessPoolExecutor(processes) as pool:
+                futures = [pool.submit(_tsqrpanel, shm.name, Ab.shape, i, j)
+                    for i, j in zip(bounds[:-1], bounds[1:])]
+                R = [f.result() for f in futures]
+        finally:
+            del Ab
+            shm.close()
+            shm.unlink()
+
+    # Combine pairs of triangular factors until one is left.
+    while len(R) > 1:
+        R = [np.linalg.qr(np.vstack(R[i:i+2]), mode="r") for i in range(0, len(R), 2)]
+    R = R[0]
+    return solve_triangular(R[:n, :n], R[:n, n])
+
+def _tsqrpanel(name, shape, start, stop):
+    # Triangular factor of rows start:stop of [A b] in shared memory.
+    shm = SharedMemory(name=name)
+    Ab = np.ndarray(shape, dtype=float, buffer=shm.buf)
+    R = np.linalg.qr(Ab[start:stop], mode="r")
+    del Ab
+    shm.close()
+    return R
+
+def lsqr(A, b, tol=1e-10, maxiter=None, precond=None):
+    """
+    lsqr(A, b, tol=1e-10, maxiter=None, precond=None)
+
+    Solve a linear least squares problem by the LSQR iteration, which uses A
+    only through products with A and A.T. A may be a dense array, a
+    scipy.sparse matrix, or a scipy.sparse.linalg.LinearOperator. With
+    precond="diag", the columns of A are first scaled to unit norm; a vector
+    d may be given instead to scale column j by d[j]. The iteration stops when
+    ||A'r|| <= tol*||A||*||r|| or ||r|| <= tol*||b||. Returns the minimizer of
+    ||b-Ax|| and the number of iterations.
+    """
+    m, n = A.shape
+    if isinstance(precond, str) and precond == "diag":
+        if scipy.sparse.issparse(A):
+            colnorm = np.sqrt(np.asarray(abs(A).power(2).sum(axis=0))).ravel()
+        else:
+            colnorm = np.linalg.norm(A, axis=0)
+        d = 1 / np.where(colnorm > 0, colnorm, 1)
+    elif precond is None:
+        d = np.ones(n)
+    else:
+        d = np.asarray(precond, dtype=float)
+    A = aslinearoperator(A)
+    maxiter = maxiter or 2 * n
+
+    # Golub-Kahan bidiagonalization of A*diag(d), started from b.
+    x = np.zeros(n)
+    beta = bnorm = np.linalg.norm(b)
+    if beta == 0:
+        return x, 0
+    u = b / beta
+    v = d * A.rmatvec(u)
+    alpha = np.linalg.norm(v)
+    if alpha == 0:
+        return x, 0
+    v /= alpha
+    w = v.copy()
+    phibar, rhobar = beta, alpha
+    anorm = 0.0
+    for k in range(1, maxiter + 1):
+        u = A.matvec(d * v) - alpha * u
+        beta = np.linalg.norm(u)
+        if beta > 0:
+            u /= beta
+        anorm = np.sqrt(anorm**2 + alpha**2 + beta**2)
+        v = d * A.rmatvec(u) - beta * v
+        alpha = np.linalg.norm(v)
+        if alpha > 0:
+            v /= alpha
+
+        # Plane rotation to eliminate the subdiagonal of the bidiagonal matrix.
+        rho = np.hypot(rhobar, beta)
+        c, s = rhobar / rho, beta / rho
+        theta, rhobar = s * alpha, -c * alpha
+        phi, phibar = c * phibar, s * phibar
+        x += (phi / rho) * w
+        w = v - (theta / rho) * w
+
+        # phibar is ||r||, and phibar*alpha*|c| is ||A'r||.
+        if phibar <= tol * bnorm or alpha * abs(c) <= tol * anorm:
+            break
+    return d * x, k
+
+def lssketch(A, b, tol=1e-12, sketchsize=None, seed=None):
+    """
+    lssketch(A, b, tol=1e-12, sketchsize=None, seed=None)
+
+    Solve a highly overdetermined linear least squares problem by sketch
+    preconditioning (as in Blendenpik). The rows of A are mixed by random
+    signs and a fast cosine transform, sketchsize of them (default 4n) are
+    sampled, and the R factor of that small sketch is used as a right
+    preconditioner for LSQR. The seed makes the random choices reproducible.
+    Returns the minimizer of ||b-Ax|| and the number of LSQR iterations.
+    """
+    A = np.asarray(A, dtype=float)
+    m, n = A.shape
+    rng = np.random.default_rng(seed)
+    sketchsize = min(m, sketchsize or 4 * n)
+
+    # Randomized orthogonal mixing, then uniform row sampling.
+    signs = rng.choice([-1.0, 1.0], size=m)
+    rows = rng.choice(m, size=sketchsize, replace=False)
+    S = dct(signs[:, None] * A, axis=0, norm="ortho")[rows]
+    R = QRFactorization(S).R
+
+    # LSQR on A*inv(R) is well conditioned whatever the conditioning of A.
+    AR = LinearOperator((m, n),
+        matvec=lambda y: A @ solve_triangular(R, y),
+        rmatvec=lambda u: solve_triangular(R, A.T @ u, trans="T"))
+    y, k = lsqr(AR, b, tol=tol)
+    return solve_triangular(R, y), k
+
 def qrfact(A):
     """
         qrfact(A)
 
-    QR factorization by Householder reflections. Returns Q and R.
+    QR factorization by Householder reflections. Returns Q and R. This forms
+    the full m-by-m Q; QRFactorization keeps Q implicit instead.
     """
     m, n = A.shape
-    Qt = np.eye(m)
-    R = np.copy(A)
-    for k in range(n):
-        z = R[k:, k]
-        w = np.stack((-np.sign(z[0]) * np.linalg.norm(z) - z[0], -z[1:]))
-        nrmw = np.linalg.norm(w)
-        if nrmw < np.finfo(float).eps: continue    # skip this iteration
-        v = w / nrmw
-        # Apply the reflection to each relevant column of R and Q
-        for j in range(k, n):
-            R[k:, j] -= 2 * np.dot(v, R[k:, j]) * v
-        for j in range(m):
-            Qt[k:, j] -= 2 * np.dot(v, Qt[k:, j]) * v 
-    return Qt.T, np.triu(R)
+    F = QRFactorization(A)
+    Q = F.apply_q(np.eye(m))
+    R = np.vstack([F.R, np.zeros((m - n, n))])
+    return Q, R
+
+class QRFactorization:
+    """
+    QRFactorization(A, blocksize=32)
+
+    Compute the QR factorization of an m-by-n matrix A with m >= n once, so
+    that any number of least-squares problems with A, or minimum-norm problems
+    with A.T, can be solved at O(mn) cost each. The Householder reflections are
+    computed in panels of blocksize columns and kept in compact WY form,
+    I - V T V', so Q is never formed. Use apply_q, apply_qt, or thin_q to work
+    with it.
+    """
+    def __init__(self, A, blocksize=32):
+        QR = np.array(A, dtype=float, order="F")    # columns are contiguous
+        m, n = QR.shape
+        self.T = []
+        for j in range(0, n, blocksize):
+            jb = min(j + blocksize, n)
+            tau = np.zeros(jb - j)
+            # Factor the panel one column at a time.
+            for k in range(j, jb):
+                z0, s = QR[k, k], np.linalg.norm(QR[k+1:, k])
+                if s == 0:
+                    continue    # already triangular; reflector is I
+                beta = -np.copysign(np.hypot(z0, s), z0)
+                tau[k - j] = (beta - z0) / beta
+                QR[k+1:, k] /= z0 - beta     # scale so that v[0] = 1
+                QR[k, k] = beta
+                v = np.hstack([1, QR[k+1:, k]])
+                QR[k:, k+1:jb] -= tau[k - j] * np.outer(v, v @ QR[k:, k+1:jb])
+
+            # Accumulate the panel's reflectors into the triangular factor T.
+            V = np.tril(QR[j:, j:jb], -1)
+            V[range(jb - j), range(jb - j)] = 1
+            G = V.T @ V
+            T = np.diag(tau)
+            for i in range(1, jb - j):
+                T[:i, i] = -tau[i] * T[:i, :i] @ G[:i, i]
+            self.T.append(T)
+            # Apply the panel's Q' to the trailing columns as one block.
+            QR[j:, jb:] -= V @ (T.T @ (V.T @ QR[j:, jb:]))
+
+        self.R = np.triu(QR[:n])
+        # Keep only the Householder vectors, with explicit zeros and unit diagonal.
+        QR[:n] = np.tril(QR[:n], -1) + np.eye(n)
+        self.V = QR
+        self.blocksize = blocksize
+
+    def apply_qt(self, b):
+        """Return Q.T @ b, where b is a vector or a matrix with m rows."""
+        y = np.array(b, dtype=float)
+        for i, T in enumerate(self.T):
+            j = i * self.blocksize
+            V = self.V[j:, j:j + T.shape[0]]
+            y[j:] -= V @ (T.T @ (V.T @ y[j:]))
+        return y
+
+    def apply_q(self, b):
+        """Return Q @ b, where b is a vector or a matrix with m rows."""
+        y = np.array(b, dtype=float)
+        for i, T in reversed(list(enumerate(self.T))):
+            j = i * self.blocksize
+            V = self.V[j:, j:j + T.shape[0]]
+            y[j:] -= V @ (T @ (V.T @ y[j:]))
+        return y
+
+    def thin_q(self):
+        """Return the first n columns of Q as an m-by-n matrix."""
+        m, n = self.V.shape
+        return self.apply_q(np.eye(m, n))
+
+    def solve(self, b):
+        """Return the minimizer of ||b - A x||. Columns of b are separate problems."""
+        n = self.R.shape[0]
+        return solve_triangular(self.R, self.apply_qt(b)[:n])
+
+    def solve_transpose(self, b):
+        """Return the minimum-norm solution of A.T x = b."""
+        m, n = self.V.shape
+        z = solve_triangular(self.R, b, trans="T")
+        y = np.zeros((m,) + z.shape[1:])
+        y[:n] = z
+        return self.apply_q(y)
+
+    def logdet(self):
+        """Return the natural log of |det(A)| for square A."""
+        return np.sum(np.log(abs(np.diag(self.R))))
+
+class UpdatableLeastSquares:
+    """
+    UpdatableLeastSquares(A, b)
+
+    Solve the linear least squares problem for A and b while rows are added to
+    or removed from the data. Only the (n+1)-by-(n+1) triangular factor R of
+    the QR factorization of [A b] is kept, so memory is O(n^2) no matter how
+    many rows are seen. Each row update costs O(n^2) by Givens rotations.
+    """
+    def __init__(self, A, b):
+        Ab = np.column_stack([A, b])
+        m, n1 = Ab.shape
+        self.R = np.zeros((n1, n1))
+        if m >= n1:
+            self.R = QRFactorization(Ab).R
+        else:
+            for row in Ab:
+                self._add(row)
+
+    def add(self, a, beta):
+        """Append the row a with right-hand side value beta (or several rows)."""
+        for row in np.column_stack([np.atleast_2d(a), np.atleast_1d(beta)]):
+            self._add(row)
+
+    def remove(self, a, beta):
+        """Delete the row a with right-hand side value beta (or several rows)."""
+        for row in np.column_stack([np.atleast_2d(a), np.atleast_1d(beta)]):
+            self._remove(row)
+
+    def _add(self, w):
+        # Rotate the new row into R, zeroing it one entry at a time.
+        R = self.R
+        w = np.array(w, dtype=float)
+        for k in range(len(w)):
+            r = np.hypot(R[k, k], w[k])
+            if r == 0:
+                continue
+            c, s = R[k, k] / r, w[k] / r
+            Rk = R[k, k:].copy()
+            R[k, k:] = c * Rk + s * w[k:]
+            w[k:] = -s * Rk + c * w[k:]
+
+    def _remove(self, w):
+        # Find the rotations that would have added w, then undo them. This is
+        # the LINPACK downdate (dchdd).
+        R = self.R
+        z = solve_triangular(R, w, trans="T")
+        alpha2 = 1 - z @ z
+        if alpha2 <= 0:
+            raise ValueError("Row cannot be removed; the problem would become rank deficient.")
+        alpha = np.sqrt(alpha2)
+        n1 = len(w)
+        c, s = np.zeros(n1), np.zeros(n1)
+        for i in range(n1 - 1, -1, -1):
+            r = np.hypot(alpha, z[i])
+            c[i], s[i] = alpha / r, z[i] / r
+            alpha = r
+        x = np.zeros(n1)
+        for i in range(n1 - 1, -1, -1):
+            x, R[i] = c[i] * x + s[i] * R[i], c[i] * R[i] - s[i] * x
+
+    def solve(self):
+        """Return the current least-squares solution."""
+        return solve_triangular(self.R[:-1, :-1], self.R[:-1, -1])
+
+    def residual_norm(self):
+        """Return the current residual norm ||b - A x||."""
+        return abs(self.R[-1, -1])
@@ -1,168 +1,906 @@
 from numpy.linalg import norm, lstsq
 import numpy as np
+import scipy.sparse as sp
+from scipy.sparse.linalg import spsolve, splu, LinearOperator
+from collections import deque
 import warnings
+from .FNC02 import LUFactorization, CholeskyFactorization
 
-def newton(f, dfdx, x1):
+class _History:
+    # Iterates kept by an iterative method: all of them ("full"), only the
+    # latest ("last"), or the latest k for an integer k (a ring buffer).
+    def __init__(self, mode="full"):
+        if mode == "full":
+            self.items = []
+        elif mode == "last":
+            self.items = deque(maxlen=1)
+        elif isinstance(mode, int) and not isinstance(mode, bool) and mode > 0:
+            self.items = deque(maxlen=mode)
+        else:
+            raise ValueError(f"unknown history mode {mode!r}")
+
+    def append(self, x):
+        self.items.append(np.copy(x))
+
+    def __getitem__(self, k):
+        return self.items[k]
+
+    def scalars(self):
+        return np.array(self.items)
+
+    def columns(self):
+        return np.column_stack(list(self.items))
+
+def newton(f, dfdx, x1, xtol=None, ftol=None, maxiter=40, history="full",
+           callback=None):
     """
-    newton(f, dfdx, x1)
+    newton(f, dfdx, x1, xtol=None, ftol=None, maxiter=40, history="full",
+           callback=None)
 
     Use Newton's method to find a root of f starting from x1, where dfdx is the
-    derivative of f. Returns a vector of root estimates.
+    derivative of f, or "auto" to compute it by automatic differentiation (see
+    Dual). Returns a vector of root estimates.
+    The iteration stops when the step is at most xtol, the residual is at most
+    ftol (both default to 100 machine epsilons), or after maxiter steps. The
+    estimates returned are all of them for history="full", only the final one
+    for history="last", or the final k for an integer k. If callback is given,
+    callback(k, x) is called with each new estimate, and the iteration stops
+    early if it returns True.
     """
+    if isinstance(dfdx, str) and dfdx == "auto":
+        dfdx = lambda x: _evaluate(f, Dual(x, [1.0])).tangent[0]
     # Operating parameters.
     eps = np.finfo(float).eps
-    funtol = 100 * eps
-    xtol = 100 * eps
-    maxiter = 40
+    funtol = 100 * eps if ftol is None else ftol
+    xtol = 100 * eps if xtol is None else xtol
 
-    x = np.zeros(maxiter)
-    x[0] = x1
+    x = _History(history)
+    x.append(x1)
+    xk = x1
     y = f(x1)
     dx = np.inf  # for initial pass below
     k = 0
 
     while (abs(dx) > xtol) and (abs(y) > funtol) and (k < maxiter):
-        dydx = dfdx(x[k])
+        dydx = dfdx(xk)
         dx = -y / dydx  # Newton step
-        x[k + 1] = x[k] + dx  # new estimate
+        xk = xk + dx  # new estimate
+        x.append(xk)
 
         k = k + 1
-        y = f(x[k])
+        y = f(xk)
+        if callback is not None and callback(k, xk):
+            break
 
     if k == maxiter:
         warnings.warn("Maximum number of iterations reached.")
 
-    return x[: k + 1]
+    return x.scalars()
 
-def secant(f, x1, x2):
+def secant(f, x1, x2, xtol=None, ftol=None, maxiter=40, history="full",
+           callback=None):
     """
-    secant(f, x1, x2)
+    secant(f, x1, x2, xtol=None, ftol=None, maxiter=40, history="full",
+           callback=None)
 
     Use the secant method to find a root of f starting from x1 and x2. Returns a
-    vector of root estimates.
+    vector of root estimates. The options are as for newton.
     """
     # Operating parameters.
     eps = np.finfo(float).eps
-    funtol = 100 * eps
-    xtol = 100 * eps
-    maxiter = 40
+    funtol = 100 * eps if ftol is None else ftol
+    xtol = 100 * eps if xtol is None else xtol
 
-    x = np.zeros(maxiter)
-    x[:2] = [x1, x2]
+    x = _History(history)
+    x.append(x1)
+    x.append(x2)
+    xold, xk = x1, x2
     y1 = f(x1)
     y2 = 100
     dx = np.inf  # for initial pass below
     k = 1
 
     while (abs(dx) > xtol) and (abs(y2) > funtol) and (k < maxiter):
-        y2 = f(x[k])
-        dx = -y2 * (x[k] - x[k - 1]) / (y2 - y1)  # secant step
-        x[k + 1] = x[k] + dx  # new estimate
+        y2 = f(xk)
+        dx = -y2 * (xk - xold) / (y2 - y1)  # secant step
+        xold, xk = xk, xk + dx  # new estimate
+        x.append(xk)
 
         k = k + 1
         y1 = y2  # current f-value becomes the old one next time
+        if callback is not None and callback(k, xk):
+            break
 
     if k == maxiter:
         warnings.warn("Maximum number of iterations reached.")
-    return x[:k+1]
+    return x.scalars()
+
+def newtonbatch(f, dfdx, x1, xtol=None, ftol=None, maxiter=40):
+    """
+    newtonbatch(f, dfdx, x1, xtol=None, ftol=None, maxiter=40)
+
+    Use Newton's method to find roots of many scalar equations at once. The
+    array x1 holds one starting point per equation, and f and dfdx are applied
+    elementwise to arrays of the same shape. Entries stop changing once they
+    converge. Returns the final root estimates, the number of iterations taken
+    by each, and a boolean array that is True where the iteration converged.
+    The tolerances and iteration limit are as for newton.
+    """
+    # Operating parameters.
+    eps = np.finfo(float).eps
+    funtol = 100 * eps if ftol is None else ftol
+    xtol = 100 * eps if xtol is None else xtol
+
+    x = np.array(x1, dtype=float)
+    y = f(x)
+    # A scalar start may be shared by an array of equations.
+    shape = np.broadcast_shapes(x.shape, np.shape(y))
+    x, y = np.broadcast_to(x, shape).copy(), np.broadcast_to(y, shape)
+    iters = np.zeros(x.shape, dtype=int)
+    converged = abs(y) <= funtol
+    for k in range(maxiter):
+        active = ~converged & np.isfinite(x)
+        if not active.any():
+            break
+        with np.errstate(divide="ignore", invalid="ignore"):
+            dx = np.where(active, -y / dfdx(x), 0)  # Newton step
+        x = x + dx  # new estimates
+        iters += active
+        y = f(x)
+        converged |= active & ((abs(dx) <= xtol) | (abs(y) <= funtol))
+
+    return x, iters, converged
 
-def newtonsys(f, jac, x1):
+def secantbatch(f, x1, x2, xtol=None, ftol=None, maxiter=40):
     """
-        newtonsys(f, jac, x1)
+    secantbatch(f, x1, x2, xtol=None, ftol=None, maxiter=40)
+
+    Use the secant method to find roots of many scalar equations at once,
+    starting from the arrays x1 and x2. The function f is applied elementwise
+    to arrays of the same shape. Entries stop changing once they converge.
+    Returns the final root estimates, the number of iterations taken by each,
+    and a boolean array that is True where the iteration converged. The
+    tolerances and iteration limit are as for newton.
+    """
+    # Operating parameters.
+    eps = np.finfo(float).eps
+    funtol = 100 * eps if ftol is None else ftol
+    xtol = 100 * eps if xtol is None else xtol
+
+    xold, x = np.broadcast_arrays(np.array(x1, dtype=float), np.array(x2, dtype=float))
+    yold, y = f(xold), f(x)
+    # A scalar start may be shared by an array of equations.
+    shape = np.broadcast_shapes(x.shape, np.shape(yold), np.shape(y))
+    xold, x = np.broadcast_to(xold, shape), np.broadcast_to(x, shape).copy()
+    yold, y = np.broadcast_to(yold, shape), np.broadcast_to(y, shape)
+    iters = np.zeros(x.shape, dtype=int)
+    converged = abs(y) <= funtol
+    for k in range(maxiter):
+        active = ~converged & np.isfinite(x)
+        if not active.any():
+            break
+        with np.errstate(divide="ignore", invalid="ignore"):
+            dx = np.where(active, -y * (x - xold) / (y - yold), 0)  # secant step
+        xold = np.where(active, x, xold)
+        yold = np.where(active, y, yold)  # current f-values become the old ones
+        x = x + dx
+        iters += active
+        y = f(x)
+        converged |= active & ((abs(dx) <= xtol) | (abs(y) <= funtol))
+
+    return x, iters, converged
+
+def newtonsys(f, jac, x1, reuse=1, contraction=0.5, lucache=None, xtol=None,
+              ftol=None, maxiter=40, history="full", callback=None):
+    """
+        newtonsys(f, jac, x1, reuse=1, contraction=0.5, lucache=None, xtol=None,
+                  ftol=None, maxiter=40, history="full", callback=None)
 
     Use Newton's method to find a root of a system of equations, starting from x1. The
     function f should return the residual vector, and the function jac should return 
-    the Jacobian matrix. Returns root estimates as a matrix, one estimate per column.
+    the Jacobian matrix, or jac="auto" computes it by autojac. Returns root
+    estimates as a matrix, one estimate per column. Steps use an LU
+    factorization of a square, nonsingular Jacobian, and least squares
+    otherwise (Gauss-Newton for overdetermined systems). With reuse > 1, the
+    factored Jacobian is kept for up to reuse steps (the chord or Shamanskii
+    method), and jac is called again only when that limit is reached or the
+    residual norm fails to shrink by the factor contraction in a step. If
+    lucache is a dict, its "factor" entry is used for the first steps when
+    present, and on return it holds the last factorization, so that it can be
+    passed to the next call. The stopping
+    tolerances (default 1000 machine epsilons) apply to the norms of the step
+    and residual; the other options are as for newton, with the estimates
+    kept as columns.
     """
+    if isinstance(jac, str) and jac == "auto":
+        jac = lambda x: autojac(f, x)
+
     # Operating parameters.
-    funtol = 1000 * np.finfo(float).eps
-    xtol = 1000 * np.finfo(float).eps
-    maxiter = 40
+    funtol = 1000 * np.finfo(float).eps if ftol is None else ftol
+    xtol = 1000 * np.finfo(float).eps if xtol is None else xtol
 
-    x = np.zeros((len(x1), maxiter))
-    x[:, 0] = x1
-    y, J = f(x1), jac(x1)
+    x = _History(history)
+    x.append(x1)
+    xk = np.array(x1, dtype=float)
+    y = f(x1)
+    if lucache is not None and "factor" in lucache:
+        F = lucache["factor"]
+    else:
+        F = _newtonfactor(jac(x1))
+    age = 0    # steps taken with the current factorization
     dx = 10.0  # for initial pass below
     k = 0
 
     while (norm(dx) > xtol) and (norm(y) > funtol) and (k < maxiter):
-        dx = -lstsq(J, y)[0]  # Newton step
-        x[:, k+1] = x[:, k] + dx
+        dx = -F.solve(y)  # Newton step
+        xk = xk + dx
+        x.append(xk)
 
         k = k + 1
-        y, J = f(x[:, k]), jac(x[:, k])
+        ynew = f(xk)
+        age = age + 1
+        # Refactor when the old Jacobian is too stale to contract well.
+        if (age >= reuse) or (norm(ynew) > contraction * norm(y)):
+            F = _newtonfactor(jac(xk))
+            age = 0
+        y = ynew
+        if callback is not None and callback(k, xk):
+            break
 
+    if lucache is not None:
+        lucache["factor"] = F
     if k == maxiter:
         warnings.warn("Maximum number of iterations reached.")
-    return x[:, :k+1]
+    return x.columns()
+
+def _newtonfactor(J):
+    # Factor a square, nonsingular Jacobian by LU; otherwise keep J for
+    # least-squares (minimum-norm) steps as lstsq gives them.
+    J = np.asarray(J, dtype=float)
+    if J.shape[0] == J.shape[1]:
+        with np.errstate(divide="ignore", invalid="ignore"):
+            F = LUFactorization(J)
+        if np.all(np.isfinite(F.LU)) and np.all(np.diag(F.LU) != 0):
+            return F
+    return _LstsqFactor(J)
+
+class _LstsqFactor:
+    def __init__(self, J):
+        self.J = J
+
+    def solve(self, b):
+        return lstsq(self.J, b)[0]
 
-def fdjac(f, x0, y0):
+def fdjac(f, x0, y0, sparsity=None, executor=None):
     """
-    fdjac(f,x0,y0)
+    fdjac(f,x0,y0,sparsity=None,executor=None)
 
     Compute a finite-difference approximation of the Jacobian matrix for f at x0,
-    where y0=f(x0) is given.
+    where y0=f(x0) is given. If sparsity is given as a boolean array or sparse
+    matrix with the nonzero pattern of the Jacobian, columns that share no
+    nonzero rows are perturbed together (Curtis-Powell-Reid), so that only one
+    evaluation of f per color from jaccolor is needed, and the result is a
+    scipy.sparse CSC matrix. If a concurrent.futures executor is given, the
+    perturbed evaluations of f run concurrently on it; for a process pool, f
+    must be picklable. The result is the same as for serial evaluation.
     """
 
     delta = np.sqrt(np.finfo(float).eps)  # FD step size
     m, n = len(y0), len(x0)
-    J = np.zeros((m, n))
-    I = np.eye(n)
+    evaluate = map if executor is None else executor.map
+    if sparsity is None:
+        J = np.zeros((m, n))
+        I = np.eye(n)
+        points = (x0 + delta * I[:, j] for j in range(n))
+        for j, fj in enumerate(evaluate(f, points)):
+            J[:, j] = (fj - y0) / delta
+        return J
+
+    S = sp.csc_matrix(sparsity, dtype=bool)
+    color = jaccolor(S)
+    rows, cols = S.nonzero()
+    vals = np.zeros(len(rows))
+    # Perturb every column of one color at once; each row sees at most one of them.
+    points = (x0 + delta * (color == c) for c in range(color.max() + 1))
+    for c, fc in enumerate(evaluate(f, points)):
+        df = (fc - y0) / delta
+        here = color[cols] == c
+        vals[here] = df[rows[here]]
+    return sp.csc_matrix((vals, (rows, cols)), shape=(m, n))
+
+def jaccolor(S):
+    """
+    jaccolor(S)
+
+    Greedily color the columns of the sparsity pattern S so that no two columns
+    of the same color have a nonzero in the same row. Returns a vector of color
+    indices 0, 1, 2, ... for the columns.
+    """
+    S = sp.csc_matrix(S, dtype=bool).astype(int)
+    G = (S.T @ S).tocsr()    # columns j and k conflict if G[j, k] != 0
+    n = S.shape[1]
+    color = -np.ones(n, dtype=int)
     for j in range(n):
-        J[:, j] = (f(x0 + delta * I[:, j]) - y0) / delta
-    return J
+        used = color[G.indices[G.indptr[j]:G.indptr[j+1]]]
+        taken = np.zeros(len(used) + 1, dtype=bool)
+        taken[used[(used >= 0) & (used < len(taken))]] = True
+        color[j] = np.argmin(taken)    # smallest color not used by a neighbor
+    return color
+
+class Dual(np.lib.mixins.NDArrayOperatorsMixin):
+    """
+    Dual(value, tangent)
+
+    Array of values carrying p directional derivatives (tangents) for
+    forward-mode automatic differentiation. The value has some shape S and the
+    tangent has shape (p, *S), with tangent[k] the derivative of the value in
+    the kth seed direction. NumPy arithmetic, elementwise functions, matrix
+    products, indexing, and reshaping propagate the tangents exactly, so a
+    function written with them can be differentiated by autojac.
+    """
+    def __init__(self, value, tangent):
+        self.value = np.asarray(value, dtype=float)
+        self.tangent = np.asarray(tangent, dtype=float)
+
+    shape = property(lambda self: self.value.shape)
+    ndim = property(lambda self: self.value.ndim)
+    size = property(lambda self: self.value.size)
+    T = property(lambda self: self.transpose())
+
+    def __len__(self):
+        return len(self.value)
+
+    def __repr__(self):
+        return f"Dual({self.value!r}, {self.tangent!r})"
+
+    def __getitem__(self, idx):
+        idx = idx if isinstance(idx, tuple) else (idx,)
+        return Dual(self.value[idx], self.tangent[(slice(None),) + idx])
+
+    def __setitem__(self, idx, x):
+        idx = idx if isinstance(idx, tuple) else (idx,)
+        x = _lift(x, len(self.tangent))
+        self.value[idx] = x.value
+        ndim = np.ndim(self.value[idx])
+        self.tangent[(slice(None),) + idx] = _expand(x.tangent, ndim)
+
+    def copy(self):
+        return Dual(self.value.copy(), self.tangent.copy())
+
+    def transpose(self, *axes):
+        if len(axes) == 1:
+            axes = axes[0]
+        axes = tuple(range(self.ndim))[::-1] if not axes else tuple(axes)
+        return Dual(self.value.transpose(axes),
+                    self.tangent.transpose((0,) + tuple(a + 1 for a in axes)))
+
+    def reshape(self, *shape, order="C"):
+        if len(shape) == 1:
+            shape = shape[0]
+        if order == "F":    # a Fortran-order reshape is a C one between transposes
+            return self.T.reshape(tuple(np.atleast_1d(shape)[::-1])).T
+        value = self.value.reshape(shape)
+        return Dual(value, self.tangent.reshape((len(self.tangent),) + value.shape))
+
+    def flatten(self, order="C"):
+        return self.reshape(-1, order=order)
+
+    ravel = flatten
+
+    def max(self, axis=None):
+        return _extreme(self, axis, np.argmax)
+
+    def min(self, axis=None):
+        return _extreme(self, axis, np.argmin)
+
+    def mean(self, axis=None):
+        count = self.size if axis is None else self.shape[axis]
+        return self.sum(axis) / count
+
+    def sum(self, axis=None):
+        if axis is None:
+            return self.flatten().sum(0)
+        axis = axis % self.ndim
+        return Dual(self.value.sum(axis), self.tangent.sum(axis + 1))
+
+    def __array_ufunc__(self, ufunc, method, *inputs, out=None, **kwargs):
+        if method != "__call__" or kwargs:
+            raise TypeError(f"Dual does not support {ufunc.__name__}.{method}")
+        if ufunc in _comparisons:    # no derivative, just the values
+            return ufunc(*(x.value if isinstance(x, Dual) else x for x in inputs))
+        p = len(self.tangent)
+        inputs = [_lift(x, p) for x in inputs]
+        if ufunc is np.matmul:
+            result = _matmul(*inputs)
+        elif ufunc in _unary:
+            x, = inputs
+            value = ufunc(x.value)
+            result = Dual(value, _unary[ufunc](x.value, value) * x.tangent)
+        elif ufunc in _binary:
+            a, b = inputs
+            value = ufunc(a.value, b.value)
+            da, db = _binary[ufunc](a.value, b.value, value)
+            result = Dual(value, da * _expand(a.tangent, value.ndim)
+                                 + db * _expand(b.tangent, value.ndim))
+        else:
+            raise TypeError(f"Dual does not support numpy.{ufunc.__name__}")
+        if out is not None:    # in-place operators
+            out[0][...] = result
+            return out[0]
+        return result
+
+    def __array_function__(self, func, types, args, kwargs):
+        if func not in _functions:
+            raise TypeError(f"Dual does not support numpy.{func.__name__}")
+        return _functions[func](*args, **kwargs)
+
+    def __array__(self, dtype=None, copy=None):
+        if self.ndim == 0:    # lets array([...]) collect scalars as objects
+            a = np.empty((), dtype=object)
+            a[()] = self
+            return a
+        raise TypeError("Dual cannot be converted to a NumPy array")
 
-def levenberg(f, x1, tol=1e-12):
+def _lift(x, p):
+    # Treat a constant as a Dual with zero tangent, and an object array of
+    # Dual and constant entries as one Dual.
+    if isinstance(x, Dual):
+        return x
+    x = np.asarray(x)
+    if x.dtype == object:
+        entries = [_lift(e, p).reshape(-1) for e in x.ravel()]
+        if not all(e.size == 1 for e in entries):
+            raise TypeError("Dual entries of an object array must be scalars")
+        return _concatenate(entries).reshape(x.shape)
+    x = x.astype(float)
+    return Dual(x, np.zeros((p,) + x.shape))
+
+def _evaluate(f, x):
+    # Apply f to the Dual x, insisting on a Dual result.
+    try:
+        y = f(x)
+    except ValueError as err:
+        if "sequence" not in str(err):
+            raise
+        raise TypeError("a Dual cannot be stored in a float array; create "
+                        "the array with np.zeros_like(x) instead") from err
+    return _lift(y, len(x.tangent))
+
+def _expand(tangent, ndim):
+    # Insert axes after the seed axis so that a tangent broadcasts against
+    # values with ndim dimensions.
+    return tangent.reshape(tangent.shape[:1] + (1,) * (ndim + 1 - tangent.ndim)
+                           + tangent.shape[1:])
+
+def _matmul(a, b):
+    # Product rule. A vector on the right is treated as a column, so that its
+    # tangent is not mistaken for a stack of matrices.
+    value = a.value @ b.value
+    if b.ndim == 1:
+        ta = a.tangent @ b.value
+        tb = (a.value @ b.tangent[..., None])[..., 0]
+    else:
+        ta, tb = a.tangent @ b.value, a.value @ b.tangent
+    return Dual(value, _expand(ta, value.ndim) + _expand(tb, value.ndim))
+
+_comparisons = {np.less, np.less_equal, np.greater, np.greater_equal,
+                np.equal, np.not_equal, np.isfinite, np.sign}
+
+# Derivatives of elementwise functions, given the argument x and value y.
+_unary = {
+    np.negative: lambda x, y: -1.0,
+    np.positive: lambda x, y: 1.0,
+    np.absolute: lambda x, y: np.sign(x),
+    np.sqrt: lambda x, y: 0.5 / y,
+    np.square: lambda x, y: 2 * x,
+    np.reciprocal: lambda x, y: -y**2,
+    np.exp: lambda x, y: y,
+    np.expm1: lambda x, y: y + 1,
+    np.log: lambda x, y: 1 / x,
+    np.log1p: lambda x, y: 1 / (1 + x),
+    np.sin: lambda x, y: np.cos(x),
+    np.cos: lambda x, y: -np.sin(x),
+    np.tan: lambda x, y: 1 + y**2,
+    np.arcsin: lambda x, y: 1 / np.sqrt(1 - x**2),
+    np.arccos: lambda x, y: -1 / np.sqrt(1 - x**2),
+    np.arctan: lambda x, y: 1 / (1 + x**2),
+    np.sinh: lambda x, y: np.cosh(x),
+    np.cosh: lambda x, y: np.sinh(x),
+    np.tanh: lambda x, y: 1 - y**2,
+}
+
+# Partial derivatives of binary elementwise functions, given the arguments a
+# and b and the value y.
+_binary = {
+    np.maximum: lambda a, b, y: (a >= b, a < b),
+    np.minimum: lambda a, b, y: (a <= b, a > b),
+    np.add: lambda a, b, y: (1.0, 1.0),
+    np.subtract: lambda a, b, y: (1.0, -1.0),
+    np.multiply: lambda a, b, y: (b, a),
+    np.true_divide: lambda a, b, y: (1 / b, -y / b),
+    np.power: lambda a, b, y: (b * a**(b - 1), np.log(np.where(a > 0, a, 1)) * y),
+}
+
+def _concatenate(arrays, axis=0):
+    p = next(len(x.tangent) for x in arrays if isinstance(x, Dual))
+    arrays = [_lift(x, p) for x in arrays]
+    axis = axis % arrays[0].ndim
+    return Dual(np.concatenate([x.value for x in arrays], axis),
+                np.concatenate([x.tangent for x in arrays], axis + 1))
+
+def _hstack(arrays):
+    arrays = [x.reshape(-1) if isinstance(x, Dual) and x.ndim == 0
+              else x if isinstance(x, Dual) else np.atleast_1d(x) for x in arrays]
+    return _concatenate(arrays, 0 if arrays[0].ndim == 1 else 1)
+
+def _vstack(arrays):
+    p = next(len(x.tangent) for x in arrays if isinstance(x, Dual))
+    arrays = [_lift(x, p) for x in arrays]
+    arrays = [x.reshape(1, -1) if x.ndim < 2 else x for x in arrays]
+    return _concatenate(arrays, 0)
+
+def _extreme(a, axis, argfun):
+    # Largest or smallest entries, with the tangents where they occur.
+    if axis is None:
+        a, axis = a.ravel(), 0
+    axis = axis % a.ndim
+    i = np.expand_dims(argfun(a.value, axis), axis)
+    t = np.take_along_axis(a.tangent, np.broadcast_to(i, a.tangent.shape[:1] + i.shape), axis + 1)
+    return Dual(np.take_along_axis(a.value, i, axis).squeeze(axis), t.squeeze(axis + 1))
+
+def _diff(a, n=1, axis=-1):
+    axis = axis % a.ndim
+    head = (slice(None),) * axis
+    for _ in range(n):
+        a = a[head + (slice(1, None),)] - a[head + (slice(None, -1),)]
+    return a
+
+def _where(c, a, b):
+    p = len(a.tangent) if isinstance(a, Dual) else len(b.tangent)
+    a, b = _lift(a, p), _lift(b, p)
+    value = np.where(c, a.value, b.value)
+    return Dual(value, np.where(c, _expand(a.tangent, value.ndim),
+                                _expand(b.tangent, value.ndim)))
+
+def _filled(a, fill):
+    # A Dual like a, with constant value.
+    return Dual(np.full(a.shape, fill, dtype=float), np.zeros(a.tangent.shape))
+
+def _dot(a, b):
+    p = len(a.tangent) if isinstance(a, Dual) else len(b.tangent)
+    return _matmul(_lift(a, p), _lift(b, p))
+
+_functions = {
+    np.concatenate: _concatenate,
+    np.hstack: _hstack,
+    np.dot: _dot,
+    np.reshape: lambda a, shape, order="C": a.reshape(shape, order=order),
+    np.ravel: lambda a, order="C": a.ravel(order),
+    np.transpose: lambda a, axes=None: a.transpose(axes),
+    np.sum: lambda a, axis=None: a.sum(axis),
+    np.max: lambda a, axis=None: a.max(axis),
+    np.min: lambda a, axis=None: a.min(axis),
+    np.amax: lambda a, axis=None: a.max(axis),
+    np.amin: lambda a, axis=None: a.min(axis),
+    np.mean: lambda a, axis=None: a.mean(axis),
+    np.diff: _diff,
+    np.vstack: _vstack,
+    np.where: _where,
+    np.zeros_like: lambda a, dtype=None: _filled(a, 0),
+    np.ones_like: lambda a, dtype=None: _filled(a, 1),
+}
+
+def autojac(f, x0, sparsity=None):
     """
-    levenberg(f,x1,tol)
+    autojac(f,x0,sparsity=None)
 
-    Use Levenberg's quasi-Newton iteration to find a root of the system f, 
-    starting from x1, with tol as the stopping tolerance in both step size and residual norm. Returns root estimates as a matrix, one estimate per column.
+    Compute the Jacobian matrix of f at x0 exactly by forward-mode automatic
+    differentiation, where f must be written with NumPy operations that Dual
+    supports; it may also return an array([...]) of Dual entries, and arrays
+    it fills in should come from np.zeros_like(x). Each column of the
+    identity is a seed direction. If sparsity is given as for fdjac, columns
+    of one color from jaccolor share a seed, so the cost is proportional to
+    the number of colors, and the result is a scipy.sparse CSC matrix.
     """
+    x0 = np.asarray(x0, dtype=float)
+    n = len(x0)
+    if sparsity is None:
+        return _evaluate(f, Dual(x0, np.eye(n))).tangent.T
+
+    S = sp.csc_matrix(sparsity, dtype=bool)
+    color = jaccolor(S)
+    seeds = np.arange(color.max() + 1)[:, None] == color    # one row per color
+    JS = _evaluate(f, Dual(x0, seeds)).tangent.T    # compressed Jacobian, one column per color
+    rows, cols = S.nonzero()
+    return sp.csc_matrix((JS[rows, color[cols]], (rows, cols)), shape=S.shape)
+
+def levenberg(f, x1, tol=1e-12, executor=None, sparsity=None, memory=None,
+               jac=None, jaccache=None, xtol=None, ftol=None, maxiter=40,
+               history="full", callback=None):
+    """
+    levenberg(f,x1,tol,executor=None,sparsity=None,memory=None,jac=None,
+              jaccache=None,xtol=None,ftol=None,maxiter=40,history="full",
+              callback=None)
+
+    Use Levenberg's quasi-Newton iteration to find a root of the system f,
+    starting from x1, with tol as the stopping tolerance in both step size
+    and residual norm. Returns root estimates as a matrix, one estimate per
+    column.
+    An executor is passed on to fdjac to evaluate Jacobian columns concurrently.
+    If the sparsity pattern of the Jacobian is given, the Jacobian and its
+    updates stay sparse and each step is found by a sparse factorization.
+    If memory is given, the Broyden updates are not applied to the Jacobian
+    but kept as a window of at most that many rank-one corrections to the last
+    finite-difference Jacobian, which enter each step through the Woodbury
+    formula. With jac="auto", Jacobians are computed exactly by autojac (using
+    the sparsity pattern, if given) rather than by fdjac. If jaccache is a
+    dict, its "jacobian" and "lam" entries are used as the starting Jacobian
+    and damping when present, and on return they hold the final ones (the
+    base Jacobian, with memory), so that a related problem can be warm-started.
+    Separate step and residual tolerances xtol and ftol override tol, and the
+    other options are as for newtonsys; up to maxiter rejected steps are also
+    allowed.
+    """
+    if isinstance(jac, str) and jac == "auto":
+        jacobian = lambda x, fx: autojac(f, x, sparsity)
+    else:
+        jacobian = lambda x, fx: fdjac(f, x, fx, sparsity, executor)
 
     # Operating parameters.
-    ftol = tol
-    xtol = tol
-    maxiter = 40
+    ftol = tol if ftol is None else ftol
+    xtol = tol if xtol is None else xtol
+    maxreject = maxiter    # rejected steps allowed, on top of maxiter
+    minlam = 1e-12         # smallest damping carried between calls
 
     n = len(x1)
-    x = np.zeros((n, maxiter+1))
-    x[:, 0] = x1
+    x = _History(history)
+    x.append(x1)
+    xk = np.array(x1, dtype=float)
     fk = f(x1)
     k = 0
     s = 10.0
-    Ak = fdjac(f, x[:, 0], fk)  # start with FD Jacobian
-    jac_is_new = True
+    if jaccache is not None and "jacobian" in jaccache:
+        Ak = jaccache["jacobian"]
+        jac_is_new = False    # may be stale
+    else:
+        Ak = jacobian(xk, fk)  # start with a full Jacobian
+        jac_is_new = True
+    if memory is not None:
+        U, V = deque(maxlen=memory), deque(maxlen=memory)  # Ak + U @ V.T
 
-    lam = 10
-    while (norm(s) > xtol) and (norm(fk) > ftol) and (k < maxiter):
+    lam = 10 if jaccache is None else max(jaccache.get("lam", 10), minlam)
+    rejects = 0
+    while ((norm(s) > xtol) and (norm(fk) > ftol) and (k < maxiter)
+           and (rejects < maxreject)):
         # Compute the proposed step.
-        B = Ak.T @ Ak + lam * np.eye(n)
-        z = Ak.T @ fk
-        s = -lstsq(B, z)[0]
+        if memory is not None:
+            Aop = _lowrank(Ak, U, V)
+            s = _lowrankstep(Ak, U, V, fk, lam)
+        elif sp.issparse(Ak):
+            s = _sparsestep(Ak, fk, lam)
+        else:
+            B = Ak.T @ Ak + lam * np.eye(n)
+            z = Ak.T @ fk
+            s = -lstsq(B, z)[0]
 
-        xnew = x[:, k] + s
+        xnew = xk + s
         fnew = f(xnew)
 
         # Do we accept the result?
         if norm(fnew) < norm(fk):  # accept
             y = fnew - fk
-            x[:, k + 1] = xnew
+            xk = xnew
+            x.append(xk)
             fk = fnew
             k = k + 1
 
             lam = lam / 10  # get closer to Newton
             # Broyden update of the Jacobian.
-            Ak = Ak + np.outer(y - Ak @ s, s / np.dot(s, s))
+            if memory is not None:
+                U.append((y - Aop @ s) / np.dot(s, s))  # oldest falls out
+                V.append(s)
+            elif sp.issparse(Ak):
+                Ak = _schubert(Ak, s, y)
+            else:
+                Ak = Ak + np.outer(y - Ak @ s, s / np.dot(s, s))
             jac_is_new = False
+            if callback is not None and callback(k, xk):
+                break
         else:  # don't accept
+            rejects = rejects + 1
             # Get closer to steepest descent.
             lam = lam * 4
             # Re-initialize the Jacobian if it's out of date.
             if not jac_is_new:
-                Ak = fdjac(f, x[:, k], fk)
+                Ak = jacobian(xk, fk)
                 jac_is_new = True
+                if memory is not None:
+                    U.clear()
+                    V.clear()
+
+    if jaccache is not None:
+        jaccache["jacobian"] = Ak
+        jaccache["lam"] = max(lam, minlam)
+    if norm(fk) > 1e-3:
+        warnings.warn("Iteration did not find a root.")
+    return x.columns()
+
+def _sparsestep(A, f, lam):
+    # Solve (A'A + lam*I) s = -A'f without forming A'A, which can be much
+    # denser than A, through the equivalent sparse augmented system
+    # [I A; A' -lam*I] [r; s] = [-f; 0].
+    m, n = A.shape
+    K = sp.bmat([[sp.eye(m), A], [A.T, -lam * sp.eye(n)]], format="csc")
+    return spsolve(K, np.hstack([-f, np.zeros(n)]))[m:]
+
+def _lowrank(A, U, V):
+    # The operator A + U @ V.T for lists of column vectors U and V, applied
+    # without forming it.
+    m, n = A.shape
+    U, V = np.array(U).reshape(-1, m).T, np.array(V).reshape(-1, n).T
+    return LinearOperator((m, n), dtype=float,
+        matvec=lambda v: A @ v + U @ (V.T @ v),
+        rmatvec=lambda u: A.T @ u + V @ (U.T @ u))
+
+def _lowrankstep(B, U, V, f, lam):
+    # Solve (A'A + lam*I) s = -A'f for A = B + U @ V.T. Since
+    # A'A = B'B + W @ C @ W.T with W = [B'U, V] and C = [0 I; I U'U], only the
+    # damped base matrix B'B + lam*I is factored (by the sparse augmented
+    # system of _sparsestep when B is sparse), and the corrections enter
+    # through the Woodbury formula with a 2k-by-2k capacitance matrix.
+    m, n = B.shape
+    U, V = np.array(U).reshape(-1, m).T, np.array(V).reshape(-1, n).T
+    if sp.issparse(B):
+        K = sp.bmat([[sp.eye(m), B], [B.T, -lam * sp.eye(n)]], format="csc")
+        lu = splu(K)
+        def solve(r):
+            r = r.reshape(n, -1)
+            return lu.solve(np.vstack([np.zeros((m, r.shape[1])), -r]))[m:]
+    else:
+        solve = CholeskyFactorization(B.T @ B + lam * np.eye(n)).solve
+
+    r = -(B.T @ f + V @ (U.T @ f))
+    y = solve(r).ravel()
+    k = U.shape[1]
+    if k == 0:
+        return y
+    W = np.hstack([B.T @ U, V])
+    Z = solve(W).reshape(n, 2 * k)
+    UU = U.T @ U
+    Cinv = np.block([[-UU, np.eye(k)], [np.eye(k), np.zeros((k, k))]])
+    return y - Z @ np.linalg.solve(Cinv + W.T @ Z, W.T @ y)
+
+def _schubert(A, s, y):
+    # Broyden update restricted to the sparsity pattern of A (Schubert's
+    # method): row i changes only in its nonzero columns, using s masked to
+    # those columns.
+    A = sp.csr_matrix(A, copy=True)
+    rows = np.repeat(np.arange(A.shape[0]), np.diff(A.indptr))
+    sj = s[A.indices]
+    denom = np.bincount(rows, weights=sj**2, minlength=A.shape[0])
+    r = np.divide(y - A @ s, denom, out=np.zeros(A.shape[0]), where=denom > 0)
+    A.data += r[rows] * sj
+    return A
+
+def newtonkrylov(f, x1, tol=1e-10, restart=20, precond=None, xtol=None,
+                 ftol=None, maxiter=40, history="full", callback=None):
+    """
+    newtonkrylov(f, x1, tol=1e-10, restart=20, precond=None, xtol=None,
+                 ftol=None, maxiter=40, history="full", callback=None)
+
+    Use the Jacobian-free Newton-Krylov method to find a root of the system f,
+    starting from x1, with tol as the stopping tolerance in both step size and
+    residual norm. Each Newton step is found inexactly by restarted GMRES,
+    using directional differences of f for the Jacobian-vector products, with
+    a relative tolerance set by the Eisenstat-Walker forcing terms. If given,
+    precond(x) should return a function that approximates the action of the
+    inverse Jacobian at x. Returns root estimates as a matrix, one estimate
+    per column. Separate step and residual tolerances xtol and ftol override
+    tol, and the other options are as for newtonsys.
+    """
+    from .FNC08 import gmres
+
+    # Operating parameters.
+    eps = np.finfo(float).eps
+    ftol = tol if ftol is None else ftol
+    xtol = tol if xtol is None else xtol
+    etamax, gamma, alpha = 0.9, 0.9, 2    # forcing term parameters
+    delta = np.sqrt(eps)
+
+    x = _History(history)
+    xk = np.array(x1, dtype=float)
+    x.append(xk)
+    fk = f(xk)
+    eta = etamax
+    s = np.inf
+    k = 0
+    while (norm(s) > xtol) and (norm(fk) > ftol) and (k < maxiter):
+        h = delta * (1 + norm(xk))
+        def jv(v):
+            # Directional difference along v, scaled to a relative step size.
+            nv = norm(v)
+            return v if nv == 0 else (f(xk + (h / nv) * v) - fk) * (nv / h)
+
+        M = None if precond is None else precond(xk)
+        s = gmres(jv, -fk, restart, eta, 20 * restart, M)[0]
+
+        # Backtrack until the residual decreases.
+        t = 1.0
+        fnew = f(xk + s)
+        while (norm(fnew) >= (1 - 1e-4 * t) * norm(fk)) and (t > 1e-4):
+            t = t / 2
+            fnew = f(xk + t * s)
+        s = t * s
+        xk = xk + s
+        x.append(xk)
+
+        # Eisenstat-Walker forcing term (choice 2), safeguarded against
+        # shrinking too fast and against oversolving near the root.
+        ratio = norm(fnew) / norm(fk)
+        etanew = gamma * ratio**alpha
+        if gamma * eta**alpha > 0.1:
+            etanew = max(etanew, gamma * eta**alpha)
+        eta = min(etamax, max(etanew, 0.5 * ftol / norm(fnew)))
+        fk = fnew
+        k = k + 1
+        if callback is not None and callback(k, xk):
+            break
 
     if norm(fk) > 1e-3:
         warnings.warn("Iteration did not find a root.")
-    return x[:, :k+1]
+    return x.columns()
+
+def continuation(f, x1, pspan, dp=None, target=4, tol=1e-12, sparsity=None):
+    """
+    continuation(f, x1, pspan, dp=None, target=4, tol=1e-12, sparsity=None)
+
+    Follow the roots of f(x, p) = 0 as the parameter p goes from pspan[0] to
+    pspan[1], starting from a guess x1 for the root at pspan[0]. Each step
+    predicts the next root by extrapolating along the two previous ones and
+    corrects it with levenberg, warm-started with the previous Jacobian. The
+    parameter step, initially dp (default 1/20 of the interval), grows when a
+    correction takes fewer than target iterations and shrinks when it takes
+    more or fails. The sparsity pattern is passed on to levenberg. Returns a
+    vector of parameter values and the roots as a matrix, one per column.
+    """
+    # Operating parameters.
+    minstep = 1e-8 * abs(pspan[1] - pspan[0])
+    maxsteps = 1000
+
+    a, b = pspan
+    dp = (b - a) / 20 if dp is None else abs(dp) * np.sign(b - a)
+    cache = {}
+    def correct(x, p):
+        # Solve at p from x, quietly; return the root and iteration count.
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            X = levenberg(lambda u: f(u, p), x, tol, sparsity=sparsity, jaccache=cache)
+        ok = norm(f(X[:, -1], p)) <= max(tol, 1e-10)
+        return X[:, -1], X.shape[1] - 1, ok
+
+    x, _, ok = correct(np.array(x1, dtype=float), a)
+    if not ok:
+        warnings.warn("No root found at the start of the parameter interval.")
+    p, roots = [a], [x]
+    while p[-1] != b and len(p) < maxsteps:
+        pnew = b if abs(b - p[-1]) <= abs(dp) + minstep else p[-1] + dp  # land on b
+        if len(p) > 1:    # secant predictor
+            xpred = roots[-1] + ((pnew - p[-1]) / (p[-1] - p[-2])) * (roots[-1] - roots[-2])
+        else:
+            xpred = roots[-1]
+        x, iters, ok = correct(xpred, pnew)
+        if ok:
+            p.append(pnew)
+            roots.append(x)
+            if iters < target:
+                dp = 2 * dp
+            elif iters > target:
+                dp = dp / 2
+        else:
+            cache.clear()    # the stored Jacobian may be to blame
+            dp = dp / 4
+            if abs(dp) < minstep:
+                warnings.warn(f"Continuation stopped at p = {p[-1]}.")
+                break
+
+    return np.array(p), np.column_stack(roots)
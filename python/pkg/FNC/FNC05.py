@@ -1,5 +1,5 @@
 import numpy as np
-from numpy.linalg import solve
+from .FNC02 import bandsolve
 
 def hatfun(x, t, k):
     """
@@ -41,57 +41,67 @@ def spinterp(t, y):
 
     Create a cubic not-a-knot spline interpolating function for data values in y given at nodes in t.
     """
+    t = np.asarray(t, dtype=float)
+    y = np.asarray(y, dtype=float)
     n = len(t) - 1
-    h = [t[i + 1] - t[i] for i in range(n)]
-
-    # Preliminary definitions.
-    Z = np.zeros([n, n])
-    I = np.eye(n)
-    E = I[: n - 1, :]
-    J = np.eye(n) + np.diag(-np.ones(n - 1), 1)
-    H = np.diag(h)
+    h = np.diff(t)
+
+    # The unknowns are ordered interval by interval, (a_k, b_k, c_k, d_k) for
+    # k = 0,...,n-1, and each condition is placed near the unknowns it
+    # involves, so that the system is banded. Each condition is given as
+    # lists of (row, column, value) triples.
+    k = np.arange(n)
+    j = np.arange(n - 1)
+    rows, cols, vals = [], [], []
+    def condition(row, col, val):
+        rows.append(row)
+        cols.append(col)
+        vals.append(val * np.ones(len(row)))
+
+    # Left not-a-knot condition (row 0).
+    condition(np.array([0, 0]), np.array([3, 7]), np.array([1, -1]))
 
     # Left endpoint interpolation:
-    AL = np.hstack([I, Z, Z, Z])
-    vL = y[:-1]
+    condition(4 * k + 1, 4 * k, 1)
 
     # Right endpoint interpolation:
-    AR = np.hstack([I, H, H**2, H**3])
-    vR = y[1:]
+    for p in range(4):
+        condition(4 * k + 2, 4 * k + p, h**p)
 
     # Continuity of first derivative:
-    A1 = E @ np.hstack([Z, J, 2 * H, 3 * H**2])
-    v1 = np.zeros(n - 1)
+    condition(4 * j + 3, 4 * j + 1, 1)
+    condition(4 * j + 3, 4 * j + 2, 2 * h[j])
+    condition(4 * j + 3, 4 * j + 3, 3 * h[j]**2)
+    condition(4 * j + 3, 4 * j + 5, -1)
 
     # Continuity of second derivative:
-    A2 = E @ np.hstack([Z, Z, J, 3 * H])
-    v2 = np.zeros(n - 1)
-
-    # Not-a-knot conditions:
-    nakL = np.hstack([np.zeros(3 * n), np.hstack([1, -1, np.zeros(n - 2)])])
-    nakR = np.hstack([np.zeros(3 * n), np.hstack([np.zeros(n - 2), 1, -1])])
-
-    # Assemble and solve the full system.
-    A = np.vstack([AL, AR, A1, A2, nakL, nakR])
-    v = np.hstack([vL, vR, v1, v2, 0, 0])
-    z = solve(A, v)
+    condition(4 * j + 4, 4 * j + 2, 1)
+    condition(4 * j + 4, 4 * j + 3, 3 * h[j])
+    condition(4 * j + 4, 4 * j + 6, -1)
+
+    # Right not-a-knot condition (last row).
+    condition(np.array([4 * n - 1] * 2), np.array([4 * n - 5, 4 * n - 1]), np.array([1, -1]))
+
+    # Assemble in banded storage and solve.
+    rows, cols, vals = np.hstack(rows), np.hstack(cols), np.hstack(vals)
+    l, u = np.max(rows - cols), np.max(cols - rows)
+    A = np.zeros((l + u + 1, 4 * n))
+    A[u + rows - cols, cols] = vals
+    v = np.zeros(4 * n)
+    v[4 * k + 1] = y[:-1]
+    v[4 * k + 2] = y[1:]
+    z = bandsolve(A, l, u, v)
 
     # Break the coefficients into separate vectors.
-    rows = np.arange(n)
-    a = z[rows]
-    b = z[n + rows]
-    c = z[2 * n + rows]
-    d = z[3 * n + rows]
-    S = [np.poly1d([d[k], c[k], b[k], a[k]]) for k in range(n)]
+    a, b, c, d = z[0::4], z[1::4], z[2::4], z[3::4]
 
     # This function evaluates the spline when called with a value for x.
     def evaluate(x):
-        f = np.zeros(x.shape)
-        for k in range(n):
-            # Evaluate this piece's cubic at the points inside it.
-            index = (x >= t[k]) & (x <= t[k + 1])
-            f[index] = S[k](x[index] - t[k])
-        return f
+        # Find the piece containing each point, and use zero outside [t_0, t_n].
+        k = np.clip(np.searchsorted(t, x, side="right") - 1, 0, n - 1)
+        s = x - t[k]
+        f = a[k] + s * (b[k] + s * (c[k] + s * d[k]))
+        return np.where((x >= t[0]) & (x <= t[n]), f, 0.0)
 
     return evaluate
 
@@ -166,7 +166,7 @@ def am2(dudt, tspan, u0, n):
         known = u[i] + h / 2 * dudt(t[i], u[i])
         # Find a root for the new value.
         F = lambda z: z - h / 2 * dudt(t[i+1], z) - known
-        unew = levenberg(F, known)
+        unew = levenberg(F, known, history="last")
         u[i+1] = unew[:, -1]
 
     return t, u.T
@@ -1,27 +1,37 @@
 import numpy as np
 # from numpy.linalg import norm, solve, lstsq
-from scipy.linalg import lu
 from scipy.sparse import csc_matrix, diags
+from .FNC02 import LUFactorization
+from .FNC04 import _History
 
 
-def poweriter(A, numiter):
+def poweriter(A, numiter, tol=0, history="full", callback=None):
     """
-    poweriter(A, numiter)
+    poweriter(A, numiter, tol=0, history="full", callback=None)
 
     Perform numiter power iterations with the matrix A, starting from a random vector, 
     and return a vector of eigenvalue estimates and the final eigenvector approximation.
+    The iteration stops sooner once the eigenvalue estimate changes by at most
+    tol relative to its size. The history and callback options are as for
+    newton, applied to the eigenvalue estimates and eigenvectors.
     """
     n = A.shape[0]
     x = np.random.randn(n)
     x = x / np.linalg.norm(x, np.inf)
-    gamma = np.zeros(numiter)
+    gamma = _History(history)
+    g = np.inf
     for k in range(numiter):
         y = A @ x
         m = np.argmax(abs(y))
-        gamma[k] = y[m] / x[m]
+        g, gold = y[m] / x[m], g
+        gamma.append(g)
         x = y / y[m]
+        if callback is not None and callback(k + 1, x):
+            break
+        if tol > 0 and abs(g - gold) <= tol * abs(g):
+            break
 
-    return gamma, x
+    return gamma.scalars(), x
 
 
 def inviter(A, s, numiter):
@@ -36,9 +46,9 @@ def inviter(A, s, numiter):
     x = np.random.randn(n)
     x = x / np.linalg.norm(x, np.inf)
     gamma = np.zeros(numiter)
-    PL, U = lu(A - s * np.eye(n), permute_l=True)
+    F = LUFactorization(A - s * np.eye(n))
     for k in range(numiter):
-        y = np.linalg.solve(U, np.linalg.solve(PL, x))
+        y = F.solve(x)
         m = np.argmax(abs(y))
         gamma[k] = x[m] / y[m] + s
         x = y / y[m]
@@ -72,13 +82,15 @@ def arnoldi(A, u, m):
     return Q, H
 
 
-def arngmres(A, b, m):
+def arngmres(A, b, m, tol=0, history="full", callback=None):
     """
-    arngmres(A, b, m)
+    arngmres(A, b, m, tol=0, history="full", callback=None)
 
     Do m iterations of GMRES for the linear system A*x=b. Return the final solution
     estimate x and a vector with the history of residual norms. (This function is for
-    demo only, not practical use.)
+    demo only, not practical use.) The iteration stops sooner once the residual
+    norm is at most tol*norm(b). The history and callback options are as for
+    newton, applied to the residual norms and solution estimates.
     """
     n = len(b)
     Q = np.zeros([n, m + 1])
@@ -86,7 +98,8 @@ def arngmres(A, b, m):
     H = np.zeros([m + 1, m])
 
     # Initial "solution" is zero.
-    residual = np.hstack([np.linalg.norm(b), np.zeros(m)])
+    residual = _History(history)
+    residual.append(np.linalg.norm(b))
 
     for j in range(m):
         # Next step of Arnoldi iteration.
@@ -101,9 +114,79 @@ def arngmres(A, b, m):
         r = np.hstack([np.linalg.norm(b), np.zeros(j + 1)])
         z = np.linalg.lstsq(H[:j + 2, :j + 1], r)[0]
         x = Q[:, :j + 1] @ z
-        residual[j + 1] = np.linalg.norm(A @ x - b)
+        residual.append(np.linalg.norm(A @ x - b))
+        if callback is not None and callback(j + 1, x):
+            break
+        if residual[-1] <= tol * np.linalg.norm(b):
+            break
+
+    return x, residual.scalars()
+
 
-    return x, residual
+def gmres(A, b, restart=20, tol=1e-10, maxiter=200, precond=None):
+    """
+    gmres(A, b, restart=20, tol=1e-10, maxiter=200, precond=None)
+
+    Solve the linear system A*x=b by GMRES restarted every restart iterations,
+    starting from zero, until the residual norm is at most tol*norm(b) or
+    maxiter iterations have been done. A may be a matrix or a function that
+    returns A*v. If given, the function precond should approximate the action
+    of inv(A); it is applied on the right, so the residuals are those of the
+    original system. Only restart+1 vectors are stored. Return the solution
+    estimate x and a vector with the history of residual norms.
+    """
+    matvec = A if callable(A) else (lambda v: A @ v)
+    M = (lambda v: v) if precond is None else precond
+    n = len(b)
+    x = np.zeros(n)
+    bnorm = np.linalg.norm(b)
+    residual = [bnorm]
+    if bnorm == 0:
+        return x, np.array(residual)
+    Q = np.zeros([n, restart + 1])
+    H = np.zeros([restart + 1, restart])
+    c, s = np.zeros(restart), np.zeros(restart)
+
+    r = b.copy()
+    k = 0
+    while k < maxiter:
+        # Arnoldi iteration on A*M with Givens rotations to keep H triangular,
+        # so that the residual norm is known without forming x.
+        beta = np.linalg.norm(r)
+        Q[:, 0] = r / beta
+        g = np.zeros(restart + 1)
+        g[0] = beta
+        for j in range(min(restart, maxiter - k)):
+            v = matvec(M(Q[:, j]))
+            for i in range(j + 1):
+                H[i, j] = Q[:, i] @ v
+                v -= H[i, j] * Q[:, i]
+            H[j + 1, j] = np.linalg.norm(v)
+            if H[j + 1, j] > 0:
+                Q[:, j + 1] = v / H[j + 1, j]
+
+            for i in range(j):    # apply the previous rotations
+                H[i, j], H[i + 1, j] = (c[i] * H[i, j] + s[i] * H[i + 1, j],
+                                        -s[i] * H[i, j] + c[i] * H[i + 1, j])
+            rho = np.hypot(H[j, j], H[j + 1, j])
+            c[j], s[j] = H[j, j] / rho, H[j + 1, j] / rho
+            H[j, j], H[j + 1, j] = rho, 0.0
+            g[j + 1] = -s[j] * g[j]
+            g[j] = c[j] * g[j]
+
+            k += 1
+            residual.append(abs(g[j + 1]))
+            if residual[-1] <= tol * bnorm:
+                break
+
+        # Update the solution from the triangular least-squares problem.
+        z = np.linalg.solve(np.triu(H[:j + 1, :j + 1]), g[:j + 1])
+        x += M(Q[:, :j + 1] @ z)
+        if residual[-1] <= tol * bnorm:
+            break
+        r = b - matvec(x)
+
+    return x, np.array(residual)
 
 
 def sprandsym(n, density, **kwargs):
@@ -1,6 +1,7 @@
 import numpy as np
 import scipy.optimize as opt
 from scipy.integrate import solve_ivp
+from .FNC02 import bandsolve
 from .FNC04 import levenberg
 
 def shoot(phi, a, b, ga, gb, init):
@@ -122,19 +123,24 @@ def bvplin(p, q, r, xspan, lval, rval, n):
 
     Return vectors of the nodes and the solution values.
     """
-    x, Dx, Dxx = diffmat2(n, xspan)
+    a, b = xspan
+    h = (b - a) / n
+    x = np.linspace(a, b, n + 1)  # nodes
 
-    P = np.diag(p(x))
-    Q = np.diag(q(x))
-    L = Dxx + P @ Dx + Q  # ODE expressed at the nodes
+    # The interior rows of Dxx + P @ Dx + Q are the centered 3-point stencils
+    # of diffmat2, so the system is tridiagonal. Store it by diagonals.
+    px = p(x[1:-1])
+    A = np.zeros((3, n + 1))
+    A[0, 2:] = 1 / h**2 + px / (2 * h)        # superdiagonal
+    A[1, 1:-1] = -2 / h**2 + q(x[1:-1])     # main diagonal
+    A[2, :-2] = 1 / h**2 - px / (2 * h)       # subdiagonal
 
     # Replace first and last rows using boundary conditions.
-    I = np.eye(n + 1)
-    A = np.vstack([I[0], L[1:-1], I[-1]])
+    A[1, [0, -1]] = 1
     b = np.hstack([lval, r(x[1:-1]), rval])
 
     # Solve the system.
-    u = np.linalg.solve(A, b)
+    u = bandsolve(A, 1, 1, b)
 
     return x, u
 
@@ -164,7 +170,9 @@ def bvp(phi, xspan, ga, gb, init):
         f[n] = gb(u[n], du_dx[n]) / h
         return f
 
-    u = levenberg(residual, init.copy())
+    # Each residual involves only the nodes in its finite-difference stencils.
+    pattern = (Dx != 0) | (Dxx != 0) | np.eye(n + 1, dtype=bool)
+    u = levenberg(residual, init.copy(), sparsity=pattern, history="last")
     return x, u[:, -1]
 
 
@@ -183,11 +191,6 @@ def fem(c, s, f, a, b, n):
     h = (b - a) / n
     x = np.linspace(a, b, n + 1)
 
-    # Templates for the subinterval matrix and vector contributions.
-    Ke = np.array([[1, -1], [-1, 1]])
-    Me = (1 / 6) * np.array([[2, 1], [1, 2]])
-    fe = (1 / 2) * np.array([1, 1])
-
     # Evaluate coefficent functions and find average values.
     cval = c(x)
     cbar = (cval[:-1] + cval[1:]) / 2
@@ -196,23 +199,19 @@ def fem(c, s, f, a, b, n):
     fval = f(x)
     fbar = (fval[:-1] + fval[1:]) / 2
 
-    # Assemble global system, one interval at a time.
-    K = np.zeros([n - 1, n - 1])
-    M = np.zeros([n - 1, n - 1])
-    f = np.zeros(n - 1)
-    K[0, 0] = cbar[0] / h
-    M[0, 0] = sbar[0] * h / 3
-    f[0] = fbar[0] * h / 2
-    K[-1, -1] = cbar[-1] / h
-    M[-1, -1] = sbar[-1] * h / 3
-    f[-1] = fbar[-1] * h / 2
-    for k in range(1, n - 1):
-        K[k - 1 : k + 1, k - 1 : k + 1] += (cbar[k] / h) * Ke
-        M[k - 1 : k + 1, k - 1 : k + 1] += (sbar[k] * h) * Me
-        f[k - 1 : k + 1] += (fbar[k] * h) * fe
+    # Assemble the global system. Each subinterval contributes (c/h)*[1 -1; -1 1]
+    # to K, (s*h/6)*[2 1; 1 2] to M, and (f*h/2)*[1, 1] to f at its two nodes,
+    # so K+M is tridiagonal.
+    d0 = (cbar[:-1] + cbar[1:]) / h + (sbar[:-1] + sbar[1:]) * h / 3
+    d1 = -cbar[1:-1] / h + sbar[1:-1] * h / 6
+    f = (fbar[:-1] + fbar[1:]) * h / 2
+    A = np.zeros((3, n - 1))
+    A[0, 1:] = d1     # superdiagonal
+    A[1] = d0         # main diagonal
+    A[2, :-1] = d1    # subdiagonal
 
     # Solve system for the interior values.
-    u = np.linalg.solve(K + M, f)
+    u = bandsolve(A, 1, 1, f)
     u = np.hstack([0, u, 0])  # put the boundary values into the result
 
     return x, u